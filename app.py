@@ -1,61 +1,40 @@
 import streamlit as st
-import pandas as pd
 import matplotlib.pyplot as plt
-import time
+from preflight import init_state, bulk_uploader, step_uploader
 
 st.set_page_config(page_title="Dashboard Quest for Change", layout="wide")
 st.title("⚡ Produire vos KPIs")
 
-# -------------------------------
-# Fonction de lecture CSV / Excel
-# -------------------------------
-def load_file(file):
-    if file is None:
-        return None
-    try:
-        if file.name.endswith(".xlsx"):
-            df = pd.read_excel(file)
-            st.caption(f"✅ {file.name} lu (Excel)")
-            return df
-        try:
-            df = pd.read_csv(file, sep=";", encoding="cp1252", on_bad_lines="skip")
-        except Exception:
-            file.seek(0)
-            df = pd.read_csv(file, sep=",", encoding="cp1252", on_bad_lines="skip")
-        st.caption(f"✅ {file.name} lu (CSV CP1252)")
-        return df
-    except Exception as e:
-        st.error(f"❌ Erreur lors de la lecture du fichier {file.name} : {e}")
-        return None
-
-# -------------------------------
-# Initialisation session_state
-# -------------------------------
-if "step" not in st.session_state:
-    st.session_state.step = 0
-if "files" not in st.session_state:
-    st.session_state.files = [None]*4
-if "dfs" not in st.session_state:
-    st.session_state.dfs = [None]*4
-
 # -------------------------------
 # Paramètres des étapes + couleurs
 # -------------------------------
 steps_info = [
     {"label": "📁 Profils individuels Le Club",
      "desc": "Importez le fichier 'extract_users_xxx.csv'. Contient tous les profils inscrits.",
+     "colonnes": ["Prénom", "Nom"], "fichier": ["extract_users", "users"],
      "bg_color": "#00796B", "text_color": "#ffffff"},
     {"label": "🏢 Profils Entreprises Le Club",
      "desc": "Importez le fichier 'Profil entreprises.csv'. Contient toutes les entreprises.",
+     "colonnes": ["Statut"], "fichier": ["entreprise"],
      "bg_color": "#F57C00", "text_color": "#ffffff"},
     {"label": "🔗 Historique des mises en relation",
      "desc": "Importez le fichier 'Historique des mises en relation.csv'. Contient toutes les interactions.",
+     "colonnes": ["Utilisateur", "Statut"], "fichier": ["mises en relation", "relation"],
      "bg_color": "#D32F2F", "text_color": "#ffffff"},
     {"label": "🧭 Base Globale Projets",
      "desc": "Importez la base interne des projets incubés pour croiser les données.",
+     "colonnes": ["Projet", "Statut d'incubation"], "fichier": ["base globale", "projet"],
      "bg_color": "#512DA8", "text_color": "#ffffff"}
 ]
 
+# -------------------------------
+# Initialisation session_state + dépôt groupé
+# -------------------------------
+init_state(len(steps_info))
+
+if st.session_state.step < len(steps_info):
+    bulk_uploader(steps_info)
+
 # -------------------------------
 # Barre de progression
 # -------------------------------
@@ -86,17 +65,7 @@ if st.session_state.step < len(steps_info):
         unsafe_allow_html=True
     )
 
-    uploaded_file = st.file_uploader("", type=["csv","xlsx"], key=f"upload_{st.session_state.step}")
-
-    if uploaded_file is not None:
-        with st.spinner("📂 Lecture du fichier..."):
-            time.sleep(1)
-            df = load_file(uploaded_file)
-        if df is not None:
-            st.session_state.files[st.session_state.step] = uploaded_file
-            st.session_state.dfs[st.session_state.step] = df
-            if st.button("➡️ Suivant"):
-                st.session_state.step += 1
+    step_uploader(steps_info)
 
 # -------------------------------
 # Quand toutes les étapes sont terminées
@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
 import json
-from io import StringIO
+import gzip
+import re
+from collections import defaultdict
+import numpy as np
+import xlsxwriter
+from io import BytesIO
 from rapidfuzz import process, fuzz
-import unidecode
+from lexique_core import normalize_str, generate_id, cluster_key, match_key, lexique_index, read_table, map_batch
 
 st.set_page_config(page_title="Lexique Dynamique", layout="wide")
 st.title("🗂 Lexique Dynamique - ID CLE / Mapping")
@@ -12,17 +17,6 @@ st.title("🗂 Lexique Dynamique - ID CLE / Mapping")
 # Fonctions
 # -------------------------------
 
-def normalize_str(s):
-    """ Normalise une string pour comparaison flexible """
-    s = str(s).lower().strip()
-    s = unidecode.unidecode(s)  # retire accents
-    s = s.replace(" ", "_")
-    return s
-
-def generate_id(index):
-    """ Génère un ID type ID001 """
-    return f"ID{str(index+1).zfill(3)}"
-
 def create_lexique(df, col_name):
     """ Crée un lexique initial à partir d'une colonne sélectionnée """
     lexique = []
@@ -31,13 +25,84 @@ def create_lexique(df, col_name):
         lexique.append({"ID_CLE": generate_id(i), "Nom canonical": val, "Variantes": [val]})
     return lexique
 
+def blocking_keys(key, size=3):
+    """ Blocs candidats d'une clé : préfixe et suffixe (tolère une faute en début ou en fin).
+
+    Les nombres de la clé font partie du bloc : "Club Paris 15" et "Club Paris 16" ne sont jamais comparés.
+    """
+    digits = tuple(re.findall(r"\d+", key))
+    return {("p", key[:size], digits), ("s", key[-size:], digits)}
+
+def create_lexique_clustered(df, col_name, threshold=90, max_block=4000):
+    """ Crée un lexique en regroupant les valeurs quasi-identiques (un ID_CLE par groupe) """
+    counts = df[col_name].dropna().value_counts(sort=False)
+    values = list(counts.index)
+    
+    # 1. Valeurs identiques après normalisation -> une seule clé à comparer
+    #    (une clé vide, ex. "!!!", reste isolée : elle ne dit rien de la valeur)
+    key_index = {}
+    value_keys = []
+    for val in values:
+        key = cluster_key(val) or ("", normalize_str(val))
+        value_keys.append(key_index.setdefault(key, len(key_index)))
+    keys = list(key_index)
+    
+    # 2. Paires candidates : comparaison toutes paires à l'intérieur de chaque bloc
+    blocks = defaultdict(list)
+    for i, key in enumerate(keys):
+        if isinstance(key, str):
+            for b in blocking_keys(key):
+                blocks[b].append(i)
+    pairs = {}
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        members = sorted(members, key=keys.__getitem__)
+        # Blocs trop gros : fenêtres glissantes (chevauchement de moitié) sur les clés triées
+        step = max_block // 2
+        for start in range(0, max(len(members) - step, 1), step):
+            window = members[start:start + max_block]
+            window_keys = [keys[i] for i in window]
+            scores = process.cdist(window_keys, window_keys, scorer=fuzz.ratio, score_cutoff=threshold, dtype=np.uint8, workers=-1)
+            rows, cols = np.nonzero(np.triu(scores, k=1))
+            for r, c in zip(rows, cols):
+                i, j = sorted((window[r], window[c]))
+                pairs[(i, j)] = int(scores[r, c])
+    
+    # 3. Union-find en lien complet : deux groupes ne fusionnent que si tous leurs membres
+    #    sont proches deux à deux (évite les chaînes A~B~C~... vers un seul ID)
+    parent = list(range(len(keys)))
+    cluster_members = {i: [i] for i in range(len(keys))}
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for (i, j), _ in sorted(pairs.items(), key=lambda p: (-p[1], p[0])):
+        ri, rj = find(i), find(j)
+        if ri == rj:
+            continue
+        if all(fuzz.ratio(keys[a], keys[b]) >= threshold for a in cluster_members[ri] for b in cluster_members[rj]):
+            root, other = min(ri, rj), max(ri, rj)
+            parent[other] = root
+            cluster_members[root] += cluster_members.pop(other)
+    
+    # 4. Un ID_CLE par groupe, nom canonique = variante la plus fréquente
+    clusters = {}
+    for val, k in zip(values, value_keys):
+        clusters.setdefault(find(k), []).append(val)
+    lexique = []
+    for i, members in enumerate(clusters.values()):
+        canonical = max(members, key=lambda v: counts[v])
+        lexique.append({"ID_CLE": generate_id(i), "Nom canonical": canonical, "Variantes": members})
+    return lexique
+
 def update_lexique_fuzzy(lexique, df, col_name, threshold=90):
     """ Met à jour un lexique existant avec un nouveau fichier, mapping fuzzy """
-    lexique_vals = [normalize_str(entry["Nom canonical"]) for entry in lexique]
-    lexique_ids  = [entry["ID_CLE"] for entry in lexique]
+    lexique_vals, lexique_ids = lexique_index(lexique)
     
     new_file_col = df[col_name].fillna("")
-    new_vals = [normalize_str(x) for x in new_file_col]
+    new_vals = [match_key(x) for x in new_file_col]
     
     mapping = []
     start_index = len(lexique)
@@ -63,11 +128,143 @@ def df_with_ids(df, col_name, mapping):
     df.insert(0, "ID_CLE", df[col_name].map(id_map).fillna("NOT_FOUND"))
     return df
 
+# -------------------------------
+# Exports (générés à la demande)
+# -------------------------------
+
+EXPORT_FORMATS = {
+    "CSV compressé (.csv.gz)": (".csv.gz", "application/gzip"),
+    "Parquet (.parquet)": (".parquet", "application/octet-stream"),
+    "Excel (.xlsx)": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV (.csv)": (".csv", "text/csv"),
+    "JSON (.json)": (".json", "application/json"),
+}
+
+# Le JSON reste en tête pour le lexique : c'est le format relu en mode mise à jour
+LEXIQUE_FORMATS = ["JSON (.json)", "CSV compressé (.csv.gz)", "Parquet (.parquet)", "Excel (.xlsx)", "CSV (.csv)"]
+# Seules les colonnes du lexique contiennent des listes à aplatir
+LEXIQUE_LIST_COLS = ["Variantes"]
+
+def iter_csv_chunks(df, chunksize=50_000, sep=";"):
+    """ Sérialise un DataFrame en CSV par morceaux (en-tête sur le premier seulement) """
+    if len(df) == 0:
+        yield df.to_csv(index=False, sep=sep)
+        return
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize].to_csv(index=False, header=(start == 0), sep=sep)
+
+# Limite de lignes d'une feuille Excel (en-tête compris)
+XLSX_MAX_ROWS = 1_048_576
+
+def flatten_lists(df, list_cols):
+    """ Aplatit les cellules de type liste (ex. Variantes du lexique) pour les formats tabulaires """
+    list_cols = [c for c in list_cols if c in df.columns]
+    if not list_cols:
+        return df
+    df = df.copy()
+    for c in list_cols:
+        df[c] = df[c].map(lambda v: " | ".join(map(str, v)) if isinstance(v, list) else v)
+    return df
+
+def stringify_mixed(df):
+    """ Convertit en texte les colonnes objet de types mélangés (ex. 12 et "ABC"), refusées par Parquet """
+    mixed = [c for c in df.columns if df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True).startswith("mixed")]
+    if not mixed:
+        return df
+    df = df.copy()
+    for c in mixed:
+        df[c] = df[c].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+def write_xlsx_rows(df, buffer, chunksize=50_000):
+    """ Écrit un DataFrame en XLSX ligne par ligne.
+
+    En mode constant_memory, xlsxwriter ignore toute écriture sur une ligne déjà passée :
+    on écrit donc strictement dans l'ordre des lignes (to_excel écrit colonne par colonne).
+    Les valeurs sont écrites telles quelles : pas de formule, de lien ni de nombre déduit du texte.
+    """
+    if len(df) >= XLSX_MAX_ROWS:
+        raise ValueError(f"{len(df)} lignes : au-delà de la limite Excel de {XLSX_MAX_ROWS - 1} lignes de données")
+    workbook = xlsxwriter.Workbook(buffer, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+        "strings_to_numbers": False,
+    })
+    worksheet = workbook.add_worksheet()
+    worksheet.write_row(0, 0, [str(c) for c in df.columns])
+    row = 1
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        for values in chunk.itertuples(index=False, name=None):
+            worksheet.write_row(row, 0, values)
+            row += 1
+    workbook.close()
+
+def export_dataframe(df, fmt, list_cols=()):
+    """ Construit le fichier d'export d'un DataFrame dans le format demandé """
+    buffer = BytesIO()
+    if fmt != "JSON (.json)":
+        df = flatten_lists(df, list_cols)
+    if fmt == "CSV compressé (.csv.gz)":
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=6) as gz:
+            for chunk in iter_csv_chunks(df):
+                gz.write(chunk.encode("utf-8"))
+    elif fmt == "Parquet (.parquet)":
+        stringify_mixed(df).to_parquet(buffer, index=False, compression="zstd")
+    elif fmt == "Excel (.xlsx)":
+        write_xlsx_rows(df, buffer)
+    elif fmt == "JSON (.json)":
+        buffer.write(df.to_json(orient="records", force_ascii=False, indent=2).encode("utf-8"))
+    else:
+        for chunk in iter_csv_chunks(df):
+            buffer.write(chunk.encode("utf-8"))
+    buffer.seek(0)
+    return buffer
+
+def export_section(df, base_name, key, formats=None, list_cols=()):
+    """ Choix du format ; le fichier n'est généré qu'au clic sur le bouton de téléchargement """
+    fmt = st.selectbox("Format d'export", formats or list(EXPORT_FORMATS), key=f"fmt_{key}")
+    suffix, mime = EXPORT_FORMATS[fmt]
+    if fmt == "Excel (.xlsx)" and len(df) >= XLSX_MAX_ROWS:
+        st.warning(f"⚠️ {len(df)} lignes : trop pour une feuille Excel ({XLSX_MAX_ROWS - 1} lignes max). Choisissez CSV compressé ou Parquet.")
+        return
+    
+    def build():
+        # Exécuté par Streamlit au clic, hors du script : l'erreur est remontée avec le format concerné
+        try:
+            return export_dataframe(df, fmt, list_cols)
+        except Exception as e:
+            raise RuntimeError(f"Export {fmt} de {base_name} impossible : {e}") from e
+    
+    st.download_button(f"💾 Télécharger {base_name}{suffix}", build, file_name=f"{base_name}{suffix}", mime=mime,
+                       on_click="ignore", key=f"dl_{key}")
+
+def unique_name(name, used):
+    """ Nom de fichier unique parmi `used` : "export.csv", "export (2).csv"... """
+    stem, dot, ext = name.rpartition(".")
+    if not dot:
+        stem, ext = name, ""
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f"{stem} ({n}){dot}{ext}"
+    used.add(candidate)
+    return candidate
+
+def forget_if_changed(result_key, inputs):
+    """ Oublie un résultat dès que les entrées qui l'ont produit changent """
+    if st.session_state.get(f"{result_key}_inputs") != inputs:
+        st.session_state.pop(result_key, None)
+        st.session_state[f"{result_key}_inputs"] = inputs
+
 # -------------------------------
 # Choix du mode
 # -------------------------------
 
-mode = st.radio("Que souhaitez-vous faire ?", ["Créer un nouveau lexique", "Mettre à jour un lexique existant"])
+mode = st.radio("Que souhaitez-vous faire ?", ["Créer un nouveau lexique", "Mettre à jour un lexique existant", "Mapper plusieurs fichiers (batch)"])
 
 if mode == "Créer un nouveau lexique":
     st.subheader("1️⃣ Upload fichier de référence")
@@ -82,14 +279,27 @@ if mode == "Créer un nouveau lexique":
             
             col_name = st.selectbox("Sélectionnez la colonne à utiliser pour générer les IDs", df_ref.columns)
             
+            regrouper = st.checkbox("Regrouper les valeurs quasi-identiques (un ID par groupe)", value=False)
+            if regrouper:
+                threshold = st.slider("Seuil de regroupement fuzzy (%)", 80, 100, 90)
+            
+            forget_if_changed("lexique_created", (ref_file.name, ref_file.size, col_name, regrouper, threshold if regrouper else None))
+            
             if st.button("Générer lexique"):
-                lexique = create_lexique(df_ref, col_name)
+                with st.spinner("Génération du lexique..."):
+                    if regrouper:
+                        st.session_state.lexique_created = create_lexique_clustered(df_ref, col_name, threshold)
+                    else:
+                        st.session_state.lexique_created = create_lexique(df_ref, col_name)
+            
+            if st.session_state.get("lexique_created") is not None:
+                lexique = st.session_state.lexique_created
                 st.success("✅ Lexique créé !")
                 
-                st.write(pd.DataFrame(lexique))
+                df_lexique = pd.DataFrame(lexique)
+                st.write(df_lexique)
                 
-                st.download_button("💾 Télécharger lexique JSON", json.dumps(lexique, ensure_ascii=False, indent=2), file_name="lexique.json")
-                st.download_button("💾 Télécharger lexique CSV", pd.DataFrame(lexique).to_csv(index=False, sep=";"), file_name="lexique.csv")
+                export_section(df_lexique, "lexique", "lexique_created", formats=LEXIQUE_FORMATS, list_cols=LEXIQUE_LIST_COLS)
         except Exception as e:
             st.error(f"❌ Erreur lors de la lecture du fichier : {e}")
 
@@ -113,9 +323,14 @@ elif mode == "Mettre à jour un lexique existant":
             
             threshold = st.slider("Seuil de correspondance fuzzy (%)", 80, 100, 90)
             
+            forget_if_changed("update_result", (lex_file.name, lex_file.size, new_file.name, new_file.size, col_name, threshold))
+            
             if st.button("Mapper et mettre à jour lexique"):
                 lexique, mapping = update_lexique_fuzzy(lexique, df_new, col_name, threshold)
-                df_mapped = df_with_ids(df_new, col_name, mapping)
+                st.session_state.update_result = (lexique, df_with_ids(df_new, col_name, mapping))
+            
+            if st.session_state.get("update_result") is not None:
+                lexique, df_mapped = st.session_state.update_result
                 
                 st.success("✅ Fichier mappé et lexique mis à jour !")
                 
@@ -125,7 +340,67 @@ elif mode == "Mettre à jour un lexique existant":
                 st.write("### Aperçu lexique mis à jour")
                 st.write(pd.DataFrame(lexique))
                 
-                st.download_button("💾 Télécharger lexique JSON mis à jour", json.dumps(lexique, ensure_ascii=False, indent=2), file_name="lexique_updated.json")
-                st.download_button("💾 Télécharger fichier mappé CSV", df_mapped.to_csv(index=False, sep=";"), file_name="fichier_mappé.csv")
+                st.write("#### Export du lexique mis à jour")
+                export_section(pd.DataFrame(lexique), "lexique_updated", "lexique_updated", formats=LEXIQUE_FORMATS, list_cols=LEXIQUE_LIST_COLS)
+                
+                st.write("#### Export du fichier mappé")
+                export_section(df_mapped, "fichier_mappé", "mapped")
+        except Exception as e:
+            st.error(f"❌ Erreur lors de la lecture du fichier : {e}")
+
+elif mode == "Mapper plusieurs fichiers (batch)":
+    st.subheader("1️⃣ Upload lexique existant (JSON)")
+    lex_file = st.file_uploader("Lexique JSON existant", type=["json"], key="batch_lexique")
+    
+    st.subheader("2️⃣ Upload fichiers à mapper")
+    batch_files = st.file_uploader("Fichiers à mapper (csv/xlsx)", type=["csv","xlsx"], accept_multiple_files=True)
+    
+    if lex_file and batch_files:
+        try:
+            lexique = json.load(lex_file)
+            
+            st.subheader("3️⃣ Colonnes à mapper par fichier")
+            jobs = []
+            used_names = set()
+            for f in batch_files:
+                # Deux exports peuvent porter le même nom : on les distingue pour l'affichage et les sorties
+                name = unique_name(f.name, used_names)
+                data = f.getvalue()
+                try:
+                    # Lecture des premières lignes seulement pour proposer les colonnes
+                    columns = read_table(f.name, data, nrows=5).columns
+                except Exception as e:
+                    st.error(f"❌ Erreur lors de la lecture du fichier {name} : {e}")
+                    continue
+                selected = st.multiselect(f"📄 {name}", list(columns), key=f"batch_cols_{f.file_id}")
+                if selected:
+                    jobs.append((name, data, selected))
+            
+            threshold = st.slider("Seuil de correspondance fuzzy (%)", 80, 100, 90, key="batch_threshold")
+            
+            forget_if_changed("batch_result", (lex_file.name, lex_file.size, threshold,
+                                               tuple((name, len(data), tuple(cols)) for name, data, cols in jobs)))
+            
+            if st.button("Mapper tous les fichiers", disabled=not jobs):
+                with st.spinner(f"Mapping de {len(jobs)} fichier(s) en parallèle..."):
+                    st.session_state.batch_result = map_batch(lexique, jobs, threshold)
+            
+            if st.session_state.get("batch_result") is not None:
+                lexique, mapped_files, errors = st.session_state.batch_result
+                
+                st.success(f"✅ {len(mapped_files)} fichier(s) mappé(s) et lexique mis à jour !")
+                for name, error in errors:
+                    st.error(f"❌ {name} non mappé : {error}")
+                
+                st.write("### Aperçu lexique consolidé")
+                st.write(pd.DataFrame(lexique))
+                
+                st.write("#### Export du lexique consolidé")
+                export_section(pd.DataFrame(lexique), "lexique_updated", "batch_lexique", formats=LEXIQUE_FORMATS, list_cols=LEXIQUE_LIST_COLS)
+                
+                for i, (name, df_mapped) in enumerate(mapped_files):
+                    with st.expander(f"📄 {name}"):
+                        st.write(df_mapped.head())
+                        export_section(df_mapped, f"{name.rsplit('.', 1)[0]}_mappé", f"batch_file_{i}")
         except Exception as e:
             st.error(f"❌ Erreur lors de la lecture du fichier : {e}")
@@ -0,0 +1,135 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+from rapidfuzz import process, fuzz
+import unidecode
+
+# -------------------------------
+# Fonctions partagées (importables par les processus du pool)
+# -------------------------------
+
+def normalize_str(s):
+    """ Normalise une string pour comparaison flexible """
+    s = str(s).lower().strip()
+    s = unidecode.unidecode(s)  # retire accents
+    s = s.replace(" ", "_")
+    return s
+
+def generate_id(index):
+    """ Génère un ID type ID001 """
+    return f"ID{str(index+1).zfill(3)}"
+
+def cluster_key(s):
+    """ Clé de regroupement : normalisation + ponctuation/espaces fusionnés """
+    return re.sub(r"[^a-z0-9]+", "_", normalize_str(s)).strip("_")
+
+def match_key(s):
+    """ Clé de recherche dans le lexique ; une valeur sans lettre ni chiffre (ex. "!!!") garde sa forme normalisée """
+    return cluster_key(s) or normalize_str(s)
+
+def lexique_index(lexique):
+    """ Index de recherche : une clé par variante distincte (au sens de match_key), associée à l'ID_CLE de son entrée """
+    vals, ids, seen = [], [], set()
+    for entry in lexique:
+        for name in [entry["Nom canonical"], *entry.get("Variantes", [])]:
+            val = match_key(name)
+            if (val, entry["ID_CLE"]) not in seen:
+                seen.add((val, entry["ID_CLE"]))
+                vals.append(val)
+                ids.append(entry["ID_CLE"])
+    return vals, ids
+
+def read_table(name, data, nrows=None):
+    """ Lit un fichier csv/xlsx à partir de son nom et de son contenu brut """
+    if name.endswith(".xlsx"):
+        return pd.read_excel(BytesIO(data), nrows=nrows)
+    return pd.read_csv(BytesIO(data), sep=None, engine="python", encoding="cp1252", nrows=nrows)
+
+# -------------------------------
+# Mapping batch
+# -------------------------------
+
+_LEXIQUE_VALS = None
+
+def _init_worker(lexique_vals):
+    """ Reçoit l'index du lexique une seule fois par processus """
+    global _LEXIQUE_VALS
+    _LEXIQUE_VALS = lexique_vals
+
+def _map_file(job, threshold):
+    """ Lit un fichier et cherche chaque valeur distincte de ses colonnes dans le lexique """
+    try:
+        return _match_file(job, threshold), None
+    except Exception as e:
+        # Une erreur sur un fichier ne doit pas faire perdre tout le batch
+        return None, str(e)
+
+def _match_file(job, threshold):
+    name, data, columns = job
+    df = read_table(name, data)
+    results = {}
+    for col in columns:
+        distinct = {}
+        for orig in df[col].dropna():
+            distinct.setdefault(match_key(orig), orig)
+        matches = {}
+        for val in distinct:
+            best = process.extractOne(val, _LEXIQUE_VALS, scorer=fuzz.ratio, score_cutoff=threshold)
+            matches[val] = best[2] if best else None
+        results[col] = (distinct, matches)
+    return df, results
+
+def map_batch(lexique, jobs, threshold=90, max_workers=None):
+    """ Mappe plusieurs fichiers / colonnes sur un même lexique en parallèle.
+
+    jobs : liste de (nom_fichier, contenu_brut, [colonnes]).
+    Les nouveaux IDs sont attribués dans l'ordre des jobs, des colonnes puis des lignes,
+    quel que soit l'ordre de fin des processus.
+    Renvoie (lexique, [(nom, df_mappé)], [(nom, erreur)]) : un fichier en erreur est écarté sans bloquer les autres.
+    """
+    lexique = list(lexique)
+    lexique_vals, lexique_ids = lexique_index(lexique)
+
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(lexique_vals,)) as pool:
+        outputs = list(pool.map(_map_file, jobs, [threshold] * len(jobs)))
+
+    # Consolidation séquentielle : les valeurs absentes du lexique sont regroupées entre elles
+    new_vals, new_ids = [], []
+    start_index = len(lexique)
+    mapped_files, errors = [], []
+    for (name, _, columns), (output, error) in zip(jobs, outputs):
+        if error is not None:
+            errors.append((name, error))
+            continue
+        df, results = output
+        for col in columns:
+            distinct, matches = results[col]
+            id_map = {}
+            for val, orig in distinct.items():
+                if matches[val] is not None:
+                    id_map[val] = lexique_ids[matches[val]]
+                    continue
+                best = process.extractOne(val, new_vals, scorer=fuzz.ratio, score_cutoff=threshold) if new_vals else None
+                if best:
+                    id_map[val] = new_ids[best[2]]
+                else:
+                    new_id = generate_id(start_index)
+                    lexique.append({"ID_CLE": new_id, "Nom canonical": orig, "Variantes": [orig]})
+                    new_vals.append(val)
+                    new_ids.append(new_id)
+                    id_map[val] = new_id
+                    start_index += 1
+            id_col = "ID_CLE" if len(columns) == 1 else f"ID_CLE_{col}"
+            if id_col in columns:
+                id_col = f"{id_col}_mappé"
+            ids = df[col].map(lambda x: id_map.get(match_key(x)) if pd.notna(x) else None)
+            # Fichier déjà mappé auparavant : l'ancienne colonne d'ID est remplacée
+            if id_col in df.columns:
+                df = df.drop(columns=id_col)
+            df.insert(columns.index(col), id_col, ids.fillna("NOT_FOUND"))
+        mapped_files.append((name, df))
+    return lexique, mapped_files, errors
@@ -0,0 +1,202 @@
+import codecs
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+import streamlit as st
+
+# -------------------------------
+# Pré-contrôle des fichiers (en-tête seulement)
+# -------------------------------
+
+SNIFF_BYTES = 64 * 1024
+
+def normalize_col(c):
+    """ Normalise un nom de colonne pour la comparaison de schémas """
+    return " ".join(str(c).lower().split())
+
+def detect_encoding(head):
+    """ UTF-8 (avec ou sans BOM) si l'extrait se décode, sinon CP1252 """
+    try:
+        # Décodeur incrémental : un caractère coupé en fin d'extrait n'est pas une erreur
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp1252"
+
+def sniff_columns(name, data, nrows=5):
+    """ Lit uniquement l'en-tête et quelques lignes d'un fichier csv/xlsx.
+
+    Renvoie (colonnes, séparateur, encodage) ; séparateur et encodage valent None pour un fichier Excel.
+    """
+    if name.endswith(".xlsx"):
+        return list(pd.read_excel(BytesIO(data), nrows=nrows).columns), None, None
+    head = data[:SNIFF_BYTES]
+    encoding = detect_encoding(head)
+    first_line = head.split(b"\n", 1)[0]
+    sep = ";" if first_line.count(b";") >= first_line.count(b",") else ","
+    df = pd.read_csv(BytesIO(head), sep=sep, encoding=encoding, encoding_errors="replace", nrows=nrows, on_bad_lines="skip")
+    return list(df.columns), sep, encoding
+
+def fingerprint(columns):
+    """ Empreinte stable d'un jeu de colonnes (ordre et casse ignorés) """
+    cols = sorted({normalize_col(c) for c in columns})
+    return hashlib.sha1("|".join(cols).encode("utf-8")).hexdigest()[:12]
+
+def match_step(name, columns, steps_info):
+    """ Retrouve l'étape attendue pour un fichier, ou None si rien ne correspond.
+
+    Une étape n'est candidate que si toutes ses colonnes de signature sont présentes ;
+    la signature la plus longue l'emporte et le nom de fichier ne sert qu'à départager.
+    """
+    cols = {normalize_col(c) for c in columns}
+    fname = name.lower()
+    candidates = []
+    for i, step in enumerate(steps_info):
+        signature = {normalize_col(c) for c in step.get("colonnes", [])}
+        if signature and signature <= cols:
+            name_ok = any(k in fname for k in step.get("fichier", []))
+            candidates.append((len(signature), name_ok, i))
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda c: c[:2])
+    if sum(1 for c in candidates if c[:2] == best[:2]) > 1:
+        return None
+    return best[2]
+
+def parse_file(name, data, sep=";", encoding="cp1252"):
+    """ Lecture complète d'un fichier accepté (sans appel Streamlit : exécutée en arrière-plan) """
+    if name.endswith(".xlsx"):
+        return pd.read_excel(BytesIO(data)), "Excel"
+    label = "UTF-8" if encoding == "utf-8-sig" else encoding.upper()
+    return pd.read_csv(BytesIO(data), sep=sep, encoding=encoding, on_bad_lines="skip"), f"CSV {label}"
+
+# -------------------------------
+# Routage des fichiers vers les étapes du wizard
+# -------------------------------
+
+def init_state(n_steps):
+    """ Initialise l'état de session du wizard """
+    if "step" not in st.session_state:
+        st.session_state.step = 0
+    if "files" not in st.session_state:
+        st.session_state.files = [None]*n_steps
+    if "dfs" not in st.session_state:
+        st.session_state.dfs = [None]*n_steps
+    if "futures" not in st.session_state:
+        st.session_state.futures = [None]*n_steps
+    if "routed" not in st.session_state:
+        st.session_state.routed = {}
+    if "bulk_seen" not in st.session_state:
+        st.session_state.bulk_seen = set()
+    if "fingerprints" not in st.session_state:
+        st.session_state.fingerprints = {}
+    if "executor" not in st.session_state:
+        st.session_state.executor = ThreadPoolExecutor(max_workers=n_steps)
+
+def _same_file(a, b):
+    """ Vrai si deux uploads désignent le même fichier déposé """
+    return a is not None and b is not None and a.file_id == b.file_id
+
+def _sniff(file):
+    """ Pré-contrôle d'un fichier uploadé : (colonnes, séparateur, encodage), ou None si l'en-tête est illisible """
+    try:
+        return sniff_columns(file.name, file.getvalue())
+    except Exception as e:
+        st.error(f"❌ Erreur lors de la lecture de l'en-tête de {file.name} : {e}")
+        return None
+
+def accept_file(file, idx, sep, encoding):
+    """ Range un fichier à une étape et lance sa lecture complète en arrière-plan """
+    st.session_state.files[idx] = file
+    st.session_state.dfs[idx] = None
+    st.session_state.futures[idx] = st.session_state.executor.submit(parse_file, file.name, file.getvalue(), sep, encoding)
+
+def route_file(file, steps_info):
+    """ Lit l'en-tête, retrouve l'étape du fichier et, s'il est reconnu, lance sa lecture complète.
+
+    Renvoie l'index de l'étape, ou None si le fichier n'est pas reconnu (il n'est alors pas lu).
+    """
+    cached = st.session_state.routed.get(file.file_id)
+    if cached is None:
+        sniffed = _sniff(file)
+        if sniffed is None:
+            return None
+        columns, sep, encoding = sniffed
+        fp = fingerprint(columns)
+        idx = st.session_state.fingerprints.get(fp)
+        if idx is None:
+            idx = match_step(file.name, columns, steps_info)
+        if idx is None:
+            return None
+        st.session_state.fingerprints[fp] = idx
+        cached = st.session_state.routed[file.file_id] = (idx, sep, encoding)
+    idx, sep, encoding = cached
+    # Fichier déjà reconnu mais remplacé entre-temps à son étape : on le remet en place
+    if not _same_file(st.session_state.files[idx], file):
+        accept_file(file, idx, sep, encoding)
+    return idx
+
+def force_file(file, idx):
+    """ Accepte un fichier non reconnu à l'étape choisie par l'utilisateur (empreinte non mémorisée) """
+    sniffed = _sniff(file)
+    if sniffed is not None:
+        accept_file(file, idx, sniffed[1], sniffed[2])
+
+def collect_df(idx):
+    """ Récupère le résultat de la lecture en arrière-plan d'une étape """
+    if st.session_state.dfs[idx] is None and st.session_state.futures[idx] is not None:
+        file = st.session_state.files[idx]
+        with st.spinner(f"📂 Lecture de {file.name}..."):
+            try:
+                df, kind = st.session_state.futures[idx].result()
+                st.session_state.dfs[idx] = df
+                st.caption(f"✅ {file.name} lu ({kind})")
+            except Exception as e:
+                st.error(f"❌ Erreur lors de la lecture du fichier {file.name} : {e}")
+                # L'étape redevient libre : le même fichier (ou un autre) peut être redéposé
+                st.session_state.futures[idx] = None
+                st.session_state.files[idx] = None
+                st.session_state.routed.pop(file.file_id, None)
+    return st.session_state.dfs[idx]
+
+def bulk_uploader(steps_info):
+    """ Dépôt de tous les fichiers d'un coup : chacun est rangé à son étape d'après son en-tête """
+    with st.expander("📥 Déposer tous les fichiers d'un coup", expanded=st.session_state.step == 0):
+        bulk_files = st.file_uploader("Chaque fichier est reconnu à son en-tête et rangé à la bonne étape",
+                                      type=["csv","xlsx"], accept_multiple_files=True, key="upload_bulk")
+        for f in bulk_files or []:
+            # Seuls les nouveaux dépôts sont routés : un fichier placé depuis à la main n'est pas écrasé
+            if f.file_id not in st.session_state.bulk_seen:
+                st.session_state.bulk_seen.add(f.file_id)
+                route_file(f, steps_info)
+            idx = st.session_state.routed.get(f.file_id, (None,))[0]
+            if idx is None:
+                st.write(f"❌ {f.name} : format non reconnu, déposez-le à son étape pour le forcer")
+            else:
+                st.write(f"✅ {f.name} → Étape {idx + 1} : {steps_info[idx]['label']}")
+        if all(fut is not None for fut in st.session_state.futures):
+            if st.button("⏩ Générer les KPIs"):
+                if all(collect_df(i) is not None for i in range(len(steps_info))):
+                    st.session_state.step = len(steps_info)
+
+def step_uploader(steps_info):
+    """ Upload de l'étape courante, avec pré-contrôle avant toute lecture complète """
+    current = st.session_state.step
+    uploaded_file = st.file_uploader("", type=["csv","xlsx"], key=f"upload_{current}")
+
+    if uploaded_file is not None and not _same_file(st.session_state.files[current], uploaded_file):
+        idx = route_file(uploaded_file, steps_info)
+        if idx is None:
+            st.warning(f"⚠️ {uploaded_file.name} ne ressemble pas au fichier attendu pour cette étape.")
+            if st.button("Utiliser ce fichier quand même"):
+                force_file(uploaded_file, current)
+        elif idx != current:
+            st.info(f"↪️ {uploaded_file.name} correspond à l'étape {idx + 1} ({steps_info[idx]['label']}), il y a été rangé.")
+
+    if st.session_state.files[current] is not None:
+        df = collect_df(current)
+        if df is not None:
+            if st.button("➡️ Suivant"):
+                st.session_state.step += 1